@@ -1,5 +1,4 @@
 import streamlit as st
-import tempfile
 from typing import Optional
 
 from modules.retriever import (
@@ -7,6 +6,7 @@ from modules.retriever import (
     extract_text_data, init_qa_chain
 )
 from modules.parser import parse_question_structure
+from modules.answer_generator import generate_answers
 from modules.utils import render_answer
 from modules.pdf_exporter import PDFExporter
 
@@ -21,6 +21,7 @@ st.title("TextQuest")
 # --- Session State Init ---
 DEFAULT_SESSION_STATE = {
     "chat_history": [],
+    "processed_question_files": set(),
     "processed_question_hashes": set(),
     "structured_questions": {},
     "structured_answers": {},
@@ -61,23 +62,45 @@ with st.sidebar:
         questions = None
 
 
-def format_question(question_data: dict) -> str:
-    """Format question with metadata."""
-    base = f"[Q{question_data['number']}] {question_data['question']}"
-    if question_data.get("is_mcq", False):
-        return f"{base} [MCQ]"  # Removed marks display
-    return base  # Removed marks display
+@st.cache_data(show_spinner=False)
+def parse_question_paper(file_bytes: bytes) -> dict:
+    """Parse a question paper once per distinct file content."""
+    docs, _ = extract_text_data(file_bytes)
+    return parse_question_structure(docs)
+
+@st.cache_resource(show_spinner=False)
+def load_textbook_index(file_hash: str, _source):
+    """Load or build the FAISS index once per textbook, shared across sessions."""
+    return load_or_build_faiss(_source, file_hash)
+
+@st.cache_resource(show_spinner=False)
+def load_qa_chain(file_hash: str, _vectordb):
+    """Build the QA chain once per textbook index."""
+    return init_qa_chain(_vectordb)
+
+def render_question_answer(q: dict) -> None:
+    """Show one answered question with its references."""
+    st.markdown(f"**Q{q['number']}. {q['question']}**")
+
+    if q.get("is_mcq", False):
+        st.caption("MCQ")  # Removed marks display
+
+    render_answer(q["answer"])
+
+    if q["sources"]:
+        with st.expander("View References"):
+            for doc in q["sources"]:
+                page = doc.metadata.get("page", "N/A")
+                st.caption(f"Page {page}")
+                st.text(doc.page_content[:500] + "...")
 
 def process_textbook(uploaded_file) -> Optional["FAISS"]:
     """Process uploaded textbook and initialize QA system."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(uploaded_file.read())
-        tmp_file_path = tmp_file.name
-
-    file_hash = compute_file_hash(open(tmp_file_path, "rb"))
+    file_bytes = uploaded_file.getvalue()
+    file_hash = compute_file_hash(file_bytes)
     if file_hash != st.session_state.textbook_hash:
-        st.session_state.vectordb = load_or_build_faiss(open(tmp_file_path, "rb"), file_hash)
-        st.session_state.qa_chain = init_qa_chain(st.session_state.vectordb)
+        st.session_state.vectordb = load_textbook_index(file_hash, file_bytes)
+        st.session_state.qa_chain = load_qa_chain(file_hash, st.session_state.vectordb)
         st.session_state.textbook_hash = file_hash
         st.success("Textbook processed successfully!")
         st.rerun()  # ✅ Updated method
@@ -89,55 +112,59 @@ if textbook and not st.session_state.vectordb:
         process_textbook(textbook)
 
 # --- Question Paper Processing ---
-if questions:
-    q_hash = compute_file_hash(questions)
+# Reruns with the same upload are caught by its file_id without touching the bytes
+if questions and questions.file_id not in st.session_state.processed_question_files:
+    q_bytes = questions.getvalue()
+    q_hash = compute_file_hash(q_bytes)
     if q_hash not in st.session_state.processed_question_hashes:
         with st.spinner("Parsing questions..."):
-            docs, _ = extract_text_data(questions)
-            st.session_state.structured_questions = parse_question_structure(docs)
+            st.session_state.structured_questions = parse_question_paper(q_bytes)
             st.session_state.structured_answers = {}
             st.session_state.processed_question_hashes.add(q_hash)
 
         if st.session_state.qa_chain:
+            progress = st.progress(0.0, text="Generating answers...")
+
+            # One placeholder per question, in flatten_questions order, filled
+            # in as each answer comes back.
+            placeholders = []
             for part, sections in st.session_state.structured_questions.items():
                 st.markdown(f"## {part}")
                 for section, questions_list in sections.items():
                     st.markdown(f"### {section}")
-                    st.session_state.structured_answers.setdefault(part, {}).setdefault(section, [])
                     for q in questions_list:
-                        with st.container():
+                        placeholder = st.empty()
+                        with placeholder.container():
                             st.markdown(f"**Q{q['number']}. {q['question']}**")
-
-                            # To this:
-                            if q.get("is_mcq", False):
-                                st.caption("MCQ")  # Removed marks display
-
-                            with st.spinner(f"Generating answer for Q{q['number']}..."):
-                                try:
-                                    formatted_question = format_question(q)
-                                    result = st.session_state.qa_chain({"query": formatted_question})
-                                    render_answer(result["result"])
-
-                                    if result["source_documents"]:
-                                        with st.expander("View References"):
-                                            for doc in result["source_documents"]:
-                                                page = doc.metadata.get("page", "N/A")
-                                                st.caption(f"Page {page}")
-                                                st.text(doc.page_content[:500] + "...")
-
-                                    st.session_state.structured_answers[part][section].append({
-                                        "number": q["number"],
-                                        "question": q["question"],
-                                        "answer": result["result"],
-                                        "sources": result["source_documents"],
-                                        "marks": q["marks"]
-                                    })
-
-                                except Exception as e:
-                                    st.error(f"Error answering question: {str(e)}")
+                            st.caption(f"Generating answer for Q{q['number']}...")
+                        placeholders.append(placeholder)
+
+            answered = set()
+
+            def show_answer(index: int, answer: dict) -> None:
+                answered.add(index)
+                with placeholders[index].container():
+                    render_question_answer(answer)
+                progress.progress(
+                    len(answered) / len(placeholders),
+                    text=f"Answered {len(answered)} of {len(placeholders)} questions"
+                )
+
+            try:
+                st.session_state.structured_answers = generate_answers(
+                    st.session_state.structured_questions,
+                    st.session_state.qa_chain,
+                    on_answer=show_answer
+                )
+            except Exception as e:
+                st.error(f"Error answering questions: {str(e)}")
+            progress.empty()
 
             st.session_state.answers_ready = True
 
+    # Recorded only after the paper was parsed and answered, so a failed upload is retried on rerun
+    st.session_state.processed_question_files.add(questions.file_id)
+
 # --- Manual Question Input ---
 if st.session_state.qa_chain:
     user_question = st.chat_input("Ask a question about the textbook...")
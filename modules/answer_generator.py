@@ -1,40 +1,163 @@
-from typing import Dict
+import asyncio
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
 from langchain.chains import RetrievalQA
-from tqdm import tqdm
-from modules.parser import extract_options
+from langchain.docstore.document import Document
+from modules.retriever import embed_texts
+
+MAX_CONCURRENT_REQUESTS = 8
+
+
+def format_question(question_data: dict) -> str:
+    """Format question with metadata."""
+    base = f"[Q{question_data['number']}] {question_data['question']}"
+    if question_data.get("is_mcq", False):
+        return f"{base} [MCQ]"  # Removed marks display
+    return base  # Removed marks display
+
+
+def flatten_questions(structured_questions: Dict) -> List[Tuple[str, str, dict]]:
+    """Flatten the part/section/question nesting into (part, section, question) entries."""
+    return [
+        (part, section, q)
+        for part, sections in structured_questions.items()
+        for section, questions in sections.items()
+        for q in questions
+    ]
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Pick ``k`` candidate rows by maximal marginal relevance.
+
+    Vectors are L2-normalized, so the dot products are cosine similarities.
+    Both similarity matrices come from one BLAS call each; the selection loop
+    only keeps a running max of similarity to the already-selected rows.
+    """
+    sim_query = candidates @ query
+    sim_pairwise = candidates @ candidates.T
+
+    selected = [int(np.argmax(sim_query))]
+    max_sim_selected = sim_pairwise[selected[0]].copy()
+    for _ in range(min(k, len(candidates)) - 1):
+        scores = lambda_mult * sim_query - (1 - lambda_mult) * max_sim_selected
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_sim_selected, sim_pairwise[best], out=max_sim_selected)
+    return selected
+
+
+def retrieve_contexts(
+    vectordb,
+    queries: List[str],
+    k: int,
+    fetch_k: Optional[int] = None,
+    lambda_mult: float = 0.5
+) -> List[List[Document]]:
+    """Embed all queries at once and run a single batched FAISS search.
+
+    With ``fetch_k`` set, ``fetch_k`` candidates are fetched per query and
+    reranked to ``k`` by MMR, matching the chain's ``search_type="mmr"``.
+    """
+    query_vectors = embed_texts(vectordb.embeddings, queries)
+    _, indices = vectordb.index.search(query_vectors, fetch_k or k)
+
+    contexts = []
+    for query_vector, row in zip(query_vectors, indices):
+        row = row[row != -1]
+        if fetch_k and len(row) > 0:
+            candidates = vectordb.index.reconstruct_batch(row)
+            row = row[mmr_select(query_vector, candidates, k, lambda_mult)]
+        contexts.append([
+            vectordb.docstore.search(vectordb.index_to_docstore_id[int(i)])
+            for i in row
+        ])
+    return contexts
 
-def generate_answers(structured_questions: Dict, qa_chain: RetrievalQA) -> Dict:
-    structured_answers = {}
 
+async def _ainvoke_all(
+    llm,
+    prompts: List[str],
+    limit: int,
+    on_result: Optional[Callable[[int, object], None]] = None
+) -> list:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _invoke(index: int, prompt: str):
+        try:
+            async with semaphore:
+                result = await llm.ainvoke(prompt)
+        except Exception as e:
+            result = e
+        if on_result:
+            on_result(index, result)
+        return result
+
+    return await asyncio.gather(*(_invoke(i, p) for i, p in enumerate(prompts)))
+
+
+def _answer_entry(question_data: dict, docs: List[Document], result) -> dict:
+    if isinstance(result, Exception):
+        answer, sources = f"❌ Error generating answer: {result}", []
+    else:
+        answer, sources = result, docs
+    return {
+        "number": question_data["number"],
+        "question": question_data["question"],
+        "answer": answer,
+        "sources": sources,
+        "marks": question_data["marks"],
+        "is_mcq": question_data.get("is_mcq", False)
+    }
+
+
+def generate_answers(
+    structured_questions: Dict,
+    qa_chain: RetrievalQA,
+    on_answer: Optional[Callable[[int, dict], None]] = None
+) -> Dict:
+    """Answer every question in one batched retrieval and concurrent LLM round.
+
+    ``on_answer(index, answer)`` is called as each answer arrives, in completion
+    order; ``index`` is the question's position in ``flatten_questions`` order.
+    """
+    flat = flatten_questions(structured_questions)
+    structured_answers = {}
     for part, sections in structured_questions.items():
-        structured_answers[part] = {}
-        for section, questions in sections.items():
-            structured_answers[part][section] = []
-
-            for q in questions:
-                try:
-                    query = q["question"]
-                    # Modify the QA chain call to:
-                    result = qa_chain({
-                        "query": query,
-                        "marks": q["marks"],
-                        "is_mcq": q.get("is_mcq", False),
-                        "options": extract_options(q["question"]) if q.get("is_mcq", False) else ""
-                    })
-                    structured_answers[part][section].append({
-                        "number": q["number"],
-                        "question": q["question"],
-                        "answer": result["result"],
-                        "sources": result["source_documents"],
-                        "marks": q["marks"]
-                    })
-                except Exception as e:
-                    structured_answers[part][section].append({
-                        "number": q["number"],
-                        "question": q["question"],
-                        "answer": f"❌ Error generating answer: {e}",
-                        "sources": [],
-                        "marks": q["marks"]
-                    })
-
-    return structured_answers
\ No newline at end of file
+        structured_answers[part] = {section: [] for section in sections}
+    if not flat:
+        return structured_answers
+
+    retriever = qa_chain.retriever
+    search_kwargs = retriever.search_kwargs
+    llm_chain = qa_chain.combine_documents_chain.llm_chain
+
+    contexts = retrieve_contexts(
+        retriever.vectorstore,
+        [q["question"] for _, _, q in flat],
+        k=search_kwargs.get("k", 4),
+        fetch_k=search_kwargs.get("fetch_k", 20) if retriever.search_type == "mmr" else None,
+        lambda_mult=search_kwargs.get("lambda_mult", 0.5)
+    )
+    prompts = [
+        llm_chain.prompt.format(
+            context="\n\n".join(doc.page_content for doc in docs),
+            question=format_question(q)
+        )
+        for (_, _, q), docs in zip(flat, contexts)
+    ]
+
+    entries = [None] * len(flat)
+
+    def _on_result(index: int, result) -> None:
+        entries[index] = _answer_entry(flat[index][2], contexts[index], result)
+        if on_answer:
+            on_answer(index, entries[index])
+
+    asyncio.run(_ainvoke_all(llm_chain.llm, prompts, MAX_CONCURRENT_REQUESTS, _on_result))
+
+    for (part, section, _), entry in zip(flat, entries):
+        structured_answers[part][section].append(entry)
+
+    return structured_answers
@@ -0,0 +1,73 @@
+import os
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+ONNX_MODEL_FILE = "model_quantized.onnx"
+MAX_SEQ_LENGTH = 384  # Matches the sentence-transformers config for all-mpnet-base-v2
+
+
+def export_onnx_model(model_name: str, model_dir: str) -> None:
+    """Export a sentence-transformers model to ONNX and int8-quantize it (needs optimum)."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=model_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    )
+
+
+class ONNXEmbeddings(Embeddings):
+    """Mean-pooled, L2-normalized sentence embeddings served by ONNX Runtime on CPU."""
+
+    def __init__(self, model_dir: str, batch_size: int = 64):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Batch texts of similar length together to keep padding short.
+        order = np.argsort([len(t) for t in texts])
+        vectors = [None] * len(texts)
+
+        for start in range(0, len(texts), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_ids],
+                padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+            )
+            inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(batch_ids, pooled):
+                vectors[i] = vector
+
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
@@ -1,50 +1,79 @@
 import re
 from langchain.docstore.document import Document
 
-import re
+_MARKS_MUL_RE = re.compile(r'(\d+)\s*[x×*]\s*(\d+)')
+_MARKS_WORD_RE = re.compile(r'\b(\d+)\s*marks?\b', re.IGNORECASE)
+_ALLOWED_MARKS = {1, 2, 3, 4, 5, 6, 8, 10}
+_OPTION_RE = re.compile(r'^\(?([a-dA-D])\)?\s+(.+)')
+_WS_RE = re.compile(r'\s+')
+_NORMALIZE_TABLE = str.maketrans({
+    "–": "-", "—": "-", "“": '"', "”": '"', "‘": "'", "’": "'"
+})
+_INSTRUCTION_PATTERN = (
+    r'(?:answer (?:any|the)|choose|fill in|rewrite|rearrange|punctuate|report'
+    r'|combine|quote|match the|complete the following|read the|write (?:a|an|the)?'
+    r'|identify|make notes|paraphrase|prepare|each question carries|attempt any'
+    r'|section [a-z]+ carries)'
+)
+_INSTRUCTION_RE = re.compile(_INSTRUCTION_PATTERN, re.IGNORECASE)
+# Classifies a line in one match; m.lastgroup names the outer group that matched.
+# SECTION comes before the instructions so "Section A carries ..." stays a header.
+_LINE_RE = re.compile(
+    r'(?P<part>PART\s*[-–—]?\s*(?P<part_id>[\w\d]+))'
+    r'|(?P<section>SECTION\s*[-–—]?\s*(?P<section_id>[\w\d]+)\s*.*)'
+    r'|(?P<instruction>' + _INSTRUCTION_PATTERN + r')'
+    r'|(?P<question>(?P<number>\(?\d+[a-zA-Z]?\)?)[\.\)]?\s*(?P<text>.+))'
+    r'|(?P<option>\(?[a-dA-D]\)?\s+.+)',
+    re.IGNORECASE
+)
 
 def parse_question_structure(documents: list) -> dict:
     structured_questions = {}
     current_part = None
     current_section = None
-    section_marks_info = {}
+    current_list = None  # Question list of the current part/section
+    section_marks = {}  # Marks per question, estimated once per section header
     part_marks = {}  # Track marks for each part
+    current_question = None
+    question_parts = []  # Text fragments of current_question, joined once at the end
 
     for doc in documents:
-        lines = [normalize_text(line.strip()) for line in doc.page_content.splitlines()]
-        lines = [line for line in lines if line]  # Remove empty lines
+        # Normalize and drop empty lines in one pass
+        lines = [line for line in map(normalize_text, doc.page_content.splitlines()) if line]
+        kinds = [_LINE_RE.match(line) for line in lines]
+        n = len(lines)
 
         i = 0
-        while i < len(lines):
+        while i < n:
             line = lines[i]
+            match = kinds[i]
+            kind = match.lastgroup if match else None
 
             # Detect PART headers
-            part_match = re.match(r'^PART\s*[-–—]?\s*([\w\d]+)', line, re.IGNORECASE)
-            if part_match:
-                current_part = f"Part {part_match.group(1).upper()}"
+            if kind == "part":
+                current_part = f"Part {match.group('part_id').upper()}"
                 structured_questions[current_part] = {}
                 part_marks[current_part] = set()  # Initialize marks set for this part
                 current_section = None
+                current_list = None
                 i += 1
                 continue
 
             # Detect SECTION headers (combine lines if needed)
-            section_line = line
             marks_info = ""
-            if i + 1 < len(lines):
+            if i + 1 < n:
                 next_line = lines[i + 1]
-                if re.search(r'\d+\s*[x×*]\s*\d+', next_line):
+                if _MARKS_MUL_RE.search(next_line):
                     marks_info = next_line.strip()
                     i += 1  # Skip the mark line
 
-            section_match = re.match(r'^SECTION\s*[-–—]?\s*([\w\d]+)\s*(.*)', section_line, re.IGNORECASE)
-            if section_match:
-                section_num = section_match.group(1).strip()
+            if kind == "section":
+                section_num = match.group("section_id").strip()
                 current_section = f"Section {section_num}"
                 if current_part:
-                    structured_questions[current_part][current_section] = []
-                    # Store marks info for this section
-                    section_marks_info[current_section] = marks_info
+                    current_list = structured_questions[current_part][current_section] = []
+                    # Estimate marks once for every question in this section
+                    section_marks[current_section] = estimate_marks(marks_info)
                 i += 1
                 continue
 
@@ -53,28 +82,27 @@ def parse_question_structure(documents: list) -> dict:
                 current_section = "General"
                 if current_section not in structured_questions[current_part]:
                     structured_questions[current_part][current_section] = []
-                    section_marks_info[current_section] = ""
+                    section_marks[current_section] = 1
+                current_list = structured_questions[current_part][current_section]
 
             # Skip known instruction lines
-            if is_instruction_line(line):
+            if kind == "instruction":
                 i += 1
                 continue
 
             # Question detection
-            q_match = re.match(r'^(\(?\d+[a-zA-Z]?\)?)[\.\)]?\s*(.+)', line)
-            if q_match:
-                number = q_match.group(1).strip("().")
-                question = q_match.group(2).strip()
+            if kind == "question":
+                number = match.group("number").strip("().")
+                question = match.group("text").strip()
                 
                 # Detect MCQ options
                 options = []
                 is_mcq = False
-                option_pattern = r'^\(?([a-dA-D])\)?\s+.+'
                 
-                while i + 1 < len(lines):
-                    next_line = lines[i + 1]
-                    if re.match(option_pattern, next_line):
-                        options.append(next_line.strip())
+                while i + 1 < n:
+                    next_match = kinds[i + 1]
+                    if next_match and next_match.lastgroup == "option":
+                        options.append(lines[i + 1].strip())
                         is_mcq = True
                         i += 1
                     else:
@@ -84,8 +112,8 @@ def parse_question_structure(documents: list) -> dict:
                 if is_mcq:
                     question += "\nOptions:\n" + "\n".join(options)
                     
-                # Use the stored marks info for this section when estimating marks
-                marks = estimate_marks(section_marks_info.get(current_section, ""))
+                # Use the marks estimated for this section
+                marks = section_marks.get(current_section, 1)
                 
                 # Track marks for this part
                 if current_part:
@@ -97,16 +125,23 @@ def parse_question_structure(documents: list) -> dict:
                     "marks": marks,
                     "is_mcq": is_mcq
                 }
-                structured_questions[current_part][current_section].append(question_data)
+                current_list.append(question_data)
+                if current_question is not None:
+                    current_question["question"] = " ".join(question_parts)
+                current_question = question_data
+                question_parts = [question]
                 i += 1
                 continue
 
             # Append continuation lines for multi-line questions
-            if structured_questions.get(current_part, {}).get(current_section):
-                structured_questions[current_part][current_section][-1]["question"] += f" {line}"
+            if current_list:
+                question_parts.append(line)
 
             i += 1
 
+    if current_question is not None:
+        current_question["question"] = " ".join(question_parts)
+
     # Categorize parts based on marks
     categorized_questions = {}
     for part, sections in structured_questions.items():
@@ -139,40 +174,30 @@ def parse_question_structure(documents: list) -> dict:
 def extract_options(question_text: str) -> str:
     options = []
     for line in question_text.splitlines():
-        opt_match = re.match(r'^\(?([a-dA-D])\)?\s+(.+)', line)
+        opt_match = _OPTION_RE.match(line)
         if opt_match:
             options.append(f"{opt_match.group(1).upper()}. {opt_match.group(2)}")
     return "\n".join(options) if options else ""
 
 
 def normalize_text(text: str) -> str:
-    text = text.replace("–", "-").replace("—", "-")
-    text = text.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+    return _WS_RE.sub(' ', text.translate(_NORMALIZE_TABLE)).strip()
 
 
 def is_instruction_line(line: str) -> bool:
-    instruction_patterns = [
-        r'^answer (any|the)', r'^choose', r'^fill in', r'^rewrite', r'^rearrange',
-        r'^punctuate', r'^report', r'^combine', r'^quote', r'^match the',
-        r'^complete the following', r'^read the', r'^write (a|an|the)?',
-        r'^identify', r'^make notes', r'^paraphrase', r'^prepare',
-        r'^each question carries', r'^attempt any', r'^section [a-z]+ carries'
-    ]
-    return any(re.search(p, line, re.IGNORECASE) for p in instruction_patterns)
+    return _INSTRUCTION_RE.match(line) is not None
 
 
 def estimate_marks(section_text: str) -> int:
     # Look for "x" or "×" for multiplying marks (e.g., "2 x 5")
-    match = re.search(r'(\d+)\s*[x×*]\s*(\d+)', section_text)
+    match = _MARKS_MUL_RE.search(section_text)
     if match:
         return int(match.group(2))
 
     # Look for explicit marks (e.g., "1 mark", "3 marks")
-    for m in [1, 2, 3, 4, 5, 6, 8, 10]:
-        if f"{m} mark" in section_text.lower() or f"{m} marks" in section_text.lower():
-            return m
+    match = _MARKS_WORD_RE.search(section_text)
+    if match and int(match.group(1)) in _ALLOWED_MARKS:
+        return int(match.group(1))
 
     # Fallback to default mark
-    return 1
\ No newline at end of file
+    return 1
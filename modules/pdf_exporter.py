@@ -1,8 +1,10 @@
 from fpdf import FPDF
-import io
 import os
 
 class PDFExporter(FPDF):
+    _last_font_request = None
+    _last_font_state = None
+
     def __init__(self):
         super().__init__()
         self.set_auto_page_break(auto=True, margin=15)
@@ -20,6 +22,20 @@ class PDFExporter(FPDF):
         self.set_right_margin(15)
         self.set_top_margin(15)
 
+    def set_font(self, family=None, style="", size=0):
+        """
+        Skip re-selecting the font when the same request is already active.
+        add_question_answer switches fonts twice per question; FPDF validates
+        and normalizes every call before noticing nothing changed.
+        """
+        request = (family, style, size)
+        state = (self.font_family, self.font_style, self.font_size_pt)
+        if request == self._last_font_request and state == self._last_font_state:
+            return
+        super().set_font(family, style, size)
+        self._last_font_request = request
+        self._last_font_state = (self.font_family, self.font_style, self.font_size_pt)
+
     def add_title(self, title):
         self.set_font("DejaVu", "B", 16)  # Use bold for the title
         self.cell(0, 10, title, ln=True, align="C")
@@ -68,6 +84,6 @@ class PDFExporter(FPDF):
         """
         Export the PDF as a byte array for storage or download.
         """
-        output = io.BytesIO()
-        self.output(output)
-        return output.getvalue()
\ No newline at end of file
+        # With no file name fpdf2 returns the document buffer itself; bytes()
+        # is needed because st.download_button does not accept a bytearray.
+        return bytes(self.output())
\ No newline at end of file
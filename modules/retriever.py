@@ -1,10 +1,22 @@
 import os
+import json
+import contextlib
+import math
 import pickle
+import uuid
 import hashlib
-import tempfile
+import shutil
+import logging
+import traceback
 
+import faiss
+import numpy as np
+import streamlit as st
+import torch
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.llms import Ollama
 from langchain.chains import RetrievalQA
@@ -12,57 +24,294 @@ from langchain.prompts import PromptTemplate
 from langchain.docstore.document import Document
 import fitz
 
+try:
+    from modules.onnx_embeddings import ONNXEmbeddings, ONNX_MODEL_FILE, export_onnx_model
+except ImportError:  # onnxruntime/transformers not installed
+    ONNXEmbeddings = None
+
+logger = logging.getLogger(__name__)
+
 # Constants
 EMBED_MODEL = "sentence-transformers/all-mpnet-base-v2"
 FAISS_DIR = "faiss_indexes"
+ONNX_MODEL_DIR = os.path.join("models", "all-mpnet-base-v2-onnx-int8")
+ONNX_EXPORT_FAILED_MARKER = ONNX_MODEL_DIR + ".export-failed"  # Stops retrying on every start
+HASH_CHUNK_SIZE = 1 << 20  # 1 MiB
+IVF_MIN_VECTORS = 5000  # Below this an exhaustive flat scan is already fast
+IVF_NPROBE = 16
+PQ_SUBQUANTIZERS = 64
+EMBED_BATCH_SIZE = {"cuda": 128, "cpu": 64}
+CHUNK_TOKENS = 256  # Stays under MPNet's 384-token window, so nothing is truncated
+CHUNK_OVERLAP_TOKENS = 26  # ~10% of CHUNK_TOKENS
+MMR_MIN_VECTORS = 30  # Smaller indexes leave MMR nothing to diversify
 os.makedirs(FAISS_DIR, exist_ok=True)
 
 def compute_file_hash(file_data) -> str:
+    # SHA-256 uses the SHA-NI extensions where available; stream file objects
+    # so the whole PDF is never read into memory just to be hashed.
+    if isinstance(file_data, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(file_data).hexdigest()
+    hasher = hashlib.sha256()
+    file_data.seek(0)
+    for chunk in iter(lambda: file_data.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
     file_data.seek(0)
-    return hashlib.md5(file_data.read()).hexdigest()
+    return hasher.hexdigest()
 
 def get_faiss_paths(file_hash: str) -> tuple:
     return (
         os.path.join(FAISS_DIR, f"{file_hash}.faiss"),
-        os.path.join(FAISS_DIR, f"{file_hash}.pkl")
+        os.path.join(FAISS_DIR, f"{file_hash}.json")
     )
 
-def extract_text_data(file_data):
-    file_data.seek(0)
-    doc = fitz.open(stream=file_data.read(), filetype="pdf")
-    documents = []
+def embedding_backend(embeddings) -> str:
+    """Name the encoder variant; each quantization produces slightly different vectors."""
+    if ONNXEmbeddings is not None and isinstance(embeddings, ONNXEmbeddings):
+        return "onnx-int8"
+    if embeddings.model_kwargs.get("device") == "cuda":
+        return "torch-cuda-fp16"
+    return "torch-cpu-int8"
+
+def index_signature(embeddings) -> dict:
+    """Settings that change the stored vectors; a mismatch forces a rebuild."""
+    return {
+        "model": EMBED_MODEL,
+        "backend": embedding_backend(embeddings),
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS
+    }
+
+def is_index_current(meta_path: str, embeddings) -> bool:
+    """Check that a cached index was built with the current embedding settings."""
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return all(meta.get(key) == value for key, value in index_signature(embeddings).items())
+
+def load_onnx_embeddings(batch_size: int):
+    """Return the int8 ONNX embedder, exporting it on first use; None if unavailable."""
+    if ONNXEmbeddings is None:
+        return None
+    if not os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_MODEL_FILE)):
+        if os.path.exists(ONNX_EXPORT_FAILED_MARKER):
+            logger.warning(
+                "Skipping ONNX export, which failed before; delete %s to retry",
+                ONNX_EXPORT_FAILED_MARKER
+            )
+            return None
+        try:
+            export_onnx_model(EMBED_MODEL, ONNX_MODEL_DIR)
+        except Exception:  # No optimum, offline hub, full disk, version mismatch...
+            logger.warning("ONNX export failed; using the torch embedder", exc_info=True)
+            os.makedirs(os.path.dirname(ONNX_EXPORT_FAILED_MARKER), exist_ok=True)
+            with open(ONNX_EXPORT_FAILED_MARKER, "w") as f:
+                f.write(traceback.format_exc())
+            return None
+    try:
+        return ONNXEmbeddings(ONNX_MODEL_DIR, batch_size=batch_size)
+    except Exception:
+        logger.warning("Could not load the ONNX model; using the torch embedder", exc_info=True)
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_embeddings():
+    """Load the embedding model once per process and share it across sessions."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        # ONNX Runtime fuses the encoder graph and runs int8 GEMMs on VNNI.
+        onnx_embeddings = load_onnx_embeddings(EMBED_BATCH_SIZE["cpu"])
+        if onnx_embeddings is not None:
+            logger.info("Embedding backend: %s", embedding_backend(onnx_embeddings))
+            return onnx_embeddings
+        torch.set_num_threads(os.cpu_count() or 1)
+
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBED_MODEL,
+        model_kwargs={"device": device},
+        encode_kwargs={
+            "normalize_embeddings": True,
+            "batch_size": EMBED_BATCH_SIZE[device]
+        },
+        show_progress=False
+    )
+
+    # Halve the weight bandwidth of the encoder: FP16 on GPU (tensor cores),
+    # int8 dynamic quantization of the Linear layers on CPU (VNNI).
+    if device == "cuda":
+        embeddings.client.half()
+    else:
+        torch.ao.quantization.quantize_dynamic(
+            embeddings.client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    logger.info("Embedding backend: %s", embedding_backend(embeddings))
+    return embeddings
+
+def embed_texts(embeddings, texts: list) -> np.ndarray:
+    """Embed texts into one C-contiguous float32 (n, d) array, normalized for inner product.
+
+    Calls the encoder directly so the (n, d) matrix is not round-tripped
+    through the list-of-lists that ``embed_documents`` returns.
+    """
+    if ONNXEmbeddings is not None and isinstance(embeddings, ONNXEmbeddings):
+        vectors = embeddings.encode(texts)
+    else:
+        vectors = embeddings.client.encode(
+            texts, show_progress_bar=embeddings.show_progress, **embeddings.encode_kwargs
+        )
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def get_tokenizer(embeddings):
+    """Return the tokenizer behind either embeddings backend."""
+    if ONNXEmbeddings is not None and isinstance(embeddings, ONNXEmbeddings):
+        return embeddings.tokenizer
+    return embeddings.client.tokenizer
+
+@st.cache_resource(show_spinner=False)
+def get_text_splitter():
+    """Token-based splitter shared by every textbook build."""
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        get_tokenizer(get_embeddings()),
+        chunk_size=CHUNK_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS
+    )
 
-    for i, page in enumerate(doc, start=1):
-        text = page.get_text("text")
-        if text.strip():
-            documents.append(Document(page_content=f"[Page {i}]\n{text}", metadata={"page": i}))
+def open_pdf(source):
+    """Open a PDF from a filesystem path, in-memory bytes or a file-like object.
 
+    Paths and bytes are handed to MuPDF as-is; only file-like objects are
+    read into a new bytes copy first.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    source.seek(0)
+    return fitz.open(stream=source.read(), filetype="pdf")
+
+def extract_text_data(source):
+    # MuPDF takes ~2 ms a page, so extraction stays in-process: PyMuPDF is not
+    # thread-safe, and under `streamlit run` every multiprocessing worker would
+    # re-execute app.py through Streamlit's stand-in __main__ module.
+    with open_pdf(source) as doc:
+        pages = [(i, page.get_text("text")) for i, page in enumerate(doc, start=1)]
+
+    documents = [
+        Document(page_content=f"[Page {i}]\n{text}", metadata={"page": i})
+        for i, text in pages if text.strip()
+    ]
     return documents, []
 
-def load_or_build_faiss(file, file_hash: str):
-    index_path, store_path = get_faiss_paths(file_hash)
+def configure_ivf(index) -> None:
+    """Set search-time IVF parameters, which FAISS does not fully persist."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return
+    ivf.nprobe = IVF_NPROBE
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()  # MMR reconstructs candidate vectors by id
+    fastscan = faiss.downcast_index(ivf)
+    if isinstance(fastscan, faiss.IndexIVFPQFastScan) and fastscan.fine_quantizer is None:
+        # read_index leaves the decoder unset, so reconstruct() would segfault.
+        fastscan.fine_quantizer = fastscan.pq
+
+def build_faiss_index(vectors: np.ndarray):
+    """Build an inner-product index over normalized vectors (cosine similarity).
 
-    if os.path.exists(index_path) and os.path.exists(store_path):
-        with open(store_path, "rb") as f:
-            embeddings = pickle.load(f)
-        vectordb = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    Small corpora get an exact flat index; larger ones an IVF index with 4-bit
+    PQ FastScan codes, which scans SIMD lookup tables instead of every vector.
+    """
+    n, d = vectors.shape
+    if n < IVF_MIN_VECTORS:
+        index = faiss.IndexFlatIP(d)
     else:
-        docs, _ = extract_text_data(file)
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = splitter.split_documents(docs)
+        nlist = min(int(4 * math.sqrt(n)), n // 39)  # FAISS wants ~39 points per centroid
+        index = faiss.index_factory(
+            d, f"IVF{nlist},PQ{PQ_SUBQUANTIZERS}x4fs", faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+    index.add(vectors)
+    configure_ivf(index)
+    return index
+
+@st.cache_resource(show_spinner=False)
+def remove_legacy_caches() -> None:
+    """Delete cache entries left by older versions, which nothing loads any more.
+
+    Those are the top-level <md5>.pkl files, which pickled the whole embedder
+    (langchain keeps its own docstore pickle inside each index folder), and
+    the <md5>.faiss folders that predate SHA-256 names and JSON sidecars.
+    Sidecar-less SHA-256 folders are left alone: another session may be
+    between save_local and writing the sidecar. Runs once per process.
+    """
+    for name in os.listdir(FAISS_DIR):
+        path = os.path.join(FAISS_DIR, name)
+        stem, ext = os.path.splitext(name)
+        if ext == ".pkl":
+            # Another process may have swept the same legacy file first
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        elif ext == ".faiss" and len(stem) == 32 and not os.path.exists(get_faiss_paths(stem)[1]):
+            shutil.rmtree(path, ignore_errors=True)
 
-        embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-        vectordb = FAISS.from_documents(chunks, embeddings)
+def load_or_build_faiss(source, file_hash: str):
+    remove_legacy_caches()
+    index_path, meta_path = get_faiss_paths(file_hash)
+    embeddings = get_embeddings()
+
+    if os.path.exists(index_path) and is_index_current(meta_path, embeddings):
+        # Read the folder save_local wrote directly, memory-mapping the inverted
+        # lists so the OS pages them in on demand and processes share them.
+        index = faiss.read_index(
+            os.path.join(index_path, "index.faiss"),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        configure_ivf(index)
+        with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        vectordb = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+    else:
+        docs, _ = extract_text_data(source)
+        chunks = get_text_splitter().split_documents(docs)
+
+        # Embed each distinct chunk text once and fan the vectors back out.
+        first_seen = {}
+        back_map = np.fromiter(
+            (first_seen.setdefault(c.page_content, len(first_seen)) for c in chunks),
+            dtype=np.intp, count=len(chunks)
+        )
+        unique_vectors = embed_texts(embeddings, list(first_seen))
+        vectors = unique_vectors[back_map]
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        vectordb = FAISS(
+            embedding_function=embeddings,
+            index=build_faiss_index(vectors),
+            docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+            index_to_docstore_id=dict(enumerate(ids)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
         vectordb.save_local(index_path)
-        with open(store_path, "wb") as f:
-            pickle.dump(embeddings, f)
+        with open(meta_path, "w") as f:
+            json.dump({
+                **index_signature(embeddings),
+                "dim": vectordb.index.d,
+                "faiss_ver": faiss.__version__
+            }, f)
 
     return vectordb
 
-def get_prompt_template():
-    return PromptTemplate(
-        input_variables=["context", "question"],
-        template="""
+# Invariant instructions come first so every request shares the same prompt
+# prefix and Ollama can reuse its KV cache for it; only the part after
+# SYSTEM_PROMPT differs between questions.
+SYSTEM_PROMPT = """
 You are an expert at answering ALL types of exam questions with 100% textbook accuracy.  
 **Automatically detect question type and respond accordingly**:
 
@@ -144,21 +393,37 @@ You are an expert at answering ALL types of exam questions with 100% textbook ac
 - Explanations unless explicitly asked  
 
 ---  
-**Textbook Content**:  
+"""
+
+QUESTION_PROMPT = """**Textbook Content**:  
 {context}  
 
 **Question**:  
 {question}  
 
 **Answer** (Auto-formatted based on question type):  
-"""  
+"""
+
+def get_prompt_template():
+    return PromptTemplate(
+        input_variables=["context", "question"],
+        template=SYSTEM_PROMPT + QUESTION_PROMPT
     )
 
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    """Create the Ollama client once per process; every QA chain shares it."""
+    # Room for the instructions, six 256-token chunks and the answer.
+    return Ollama(model="gemma3:4b-it-qat", num_ctx=4096, keep_alive="30m")
+
 def init_qa_chain(vectordb):
-    retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 6, "fetch_k": 15})
-    llm = Ollama(model="gemma3:4b-it-qat")
+    ntotal = vectordb.index.ntotal
+    if ntotal < MMR_MIN_VECTORS:
+        retriever = vectordb.as_retriever(search_type="similarity", search_kwargs={"k": min(6, ntotal)})
+    else:
+        retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": 6, "fetch_k": 15})
     return RetrievalQA.from_chain_type(
-        llm=llm,
+        llm=get_llm(),
         retriever=retriever,
         return_source_documents=True,
         chain_type_kwargs={"prompt": get_prompt_template()}
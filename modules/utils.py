@@ -1,40 +1,55 @@
 import re
 import streamlit as st
 
+_CODE_FENCE_RE = re.compile(r"^\s*```")
+_LATEX_CMD_RE = re.compile(r"\\(?:frac|sum|int|pi|theta|epsilon)")
+# "$$ ... $$" on one line, or a bare "$$" fence line; group 1 is the body
+_LATEX_BLOCK_RE = re.compile(r"^\$\$(?:(.*)\$\$)?$")
+# One or more backslashes, so both "\begin{equation}" and an escaped "\\begin{equation}" go
+_UNSUPPORTED_LATEX_RE = re.compile(r"\\+(?:begin\{equation\}|end\{equation\}|ref|cite)")
+_NONASCII_RE = re.compile(r'[^\x00-\x7F]+')
+
 def sanitize_latex(latex: str) -> str:
-    unsupported = [
-        r"\\begin{equation}", r"\\end{equation}", r"\\ref", r"\\cite"
-    ]
-    for cmd in unsupported:
-        latex = latex.replace(cmd, "")
-    latex = re.sub(r'[^\x00-\x7F]+', '', latex)
-    return latex
+    return _NONASCII_RE.sub('', _UNSUPPORTED_LATEX_RE.sub('', latex))
+
+def flush_markdown(markdown_buffer: list):
+    """Render a run of plain lines as one markdown widget and clear the run."""
+    if markdown_buffer:
+        # Blank-line joins keep each line its own block, as one call per line did.
+        st.markdown("\n\n".join(markdown_buffer))
+        markdown_buffer.clear()
 
 def render_answer(answer: str):
     code_block = False
     code_buffer = []
+    markdown_buffer = []
 
     for line in answer.splitlines():
-        if line.strip().startswith("```"):
+        if _CODE_FENCE_RE.match(line):
             if code_block:
                 st.code("\n".join(code_buffer))
                 code_block = False
                 code_buffer = []
             else:
+                flush_markdown(markdown_buffer)
                 code_block = True
         elif code_block:
             code_buffer.append(line)
-        elif line.startswith("$$") and line.endswith("$$"):
-            sanitized = sanitize_latex(line.strip("$$"))
+        elif latex_block := _LATEX_BLOCK_RE.match(line):
+            flush_markdown(markdown_buffer)
+            sanitized = sanitize_latex(latex_block.group(1) or "")
             try:
                 st.latex(f"$$ {sanitized} $$")
             except Exception as e:
                 st.error(f"KaTeX error: {e}")
-        elif re.search(r"\\frac|\\sum|\\int|\\pi|\\theta|\\epsilon", line):
+        elif _LATEX_CMD_RE.search(line):
+            flush_markdown(markdown_buffer)
             sanitized = sanitize_latex(line)
             try:
                 st.latex(sanitized)
             except Exception as e:
                 st.error(f"KaTeX error: {e}")
         else:
-            st.markdown(line)
+            markdown_buffer.append(line)
+
+    flush_markdown(markdown_buffer)